@@ -2,15 +2,138 @@ import os
 import csv
 import time
 import cv2
+import dlib
 import face_recognition
 import datetime
+import json
+import queue
+import threading
+import numpy as np
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+try:
+    import faiss
+except ImportError:  # fall back to the in-process matcher
+    faiss = None
+
+try:
+    from numba import njit, prange
+except ImportError:  # fall back to numpy
+    njit = None
+
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _nearest(known, probes, out_idx, out_dot):
+        """Write the index and int8 inner product of each probe's most similar known face"""
+        for p in prange(probes.shape[0]):
+            best = 0
+            best_dot = -2 ** 31
+            for k in range(known.shape[0]):
+                s = 0
+                for c in range(known.shape[1]):
+                    s += np.int32(known[k, c]) * np.int32(probes[p, c])
+                if s > best_dot:
+                    best_dot = s
+                    best = k
+            out_idx[p] = best
+            out_dot[p] = best_dot
+else:
+    def _nearest(known, probes, out_idx, out_dot):
+        """Write the index and int8 inner product of each probe's most similar known face"""
+        dots = np.einsum('ij,kj->ik', probes, known, dtype=np.int32)
+        out_idx[:] = dots.argmax(axis=1)
+        out_dot[:] = dots[np.arange(len(probes)), out_idx]
+
+IMAGE_EXTS = {'.jpg', '.jpeg', '.png'}
+
+# Bytes of random token at the start of the encoding cache, matched by its JSON index
+CACHE_TOKEN_SIZE = 16
+
+def _split_image_name(filename):
+    """Return the user name for an enrollment image filename, or None if it isn't one"""
+    name, _, ext = filename.rpartition('.')
+    if name and '.' + ext.lower() in IMAGE_EXTS:
+        return name
+    return None
+
+def _encode_one(path):
+    """Encode the first face in an image file; runs inside a worker process"""
+    image = face_recognition.load_image_file(path)
+    
+    # Get face encodings (might be more than one face in the image)
+    face_encodings = face_recognition.face_encodings(
+        image,
+        num_jitters=FaceAttendanceSystem.ENROLL_JITTERS,
+        model=FaceAttendanceSystem.ENROLL_MODEL)
+    return path, face_encodings[0] if len(face_encodings) > 0 else None
+
+class _Grabber(threading.Thread):
+    """Read webcam frames in the background, keeping only the newest one"""
+    def __init__(self, cap):
+        super().__init__(daemon=True)
+        self.cap = cap
+        self.q = queue.Queue(maxsize=1)
+        self.stopped = False
+        
+    def run(self):
+        while not self.stopped:
+            ret, frame = self.cap.read()
+            
+            # Hand a failed read on as None so the consumer can stop
+            if not ret:
+                frame = None
+                self.stopped = True
+                
+            # Replace any frame the consumer hasn't picked up yet
+            try:
+                self.q.get_nowait()
+            except queue.Empty:
+                pass
+            self.q.put(frame)
+            
+    def stop(self):
+        """Stop reading and wait for the thread to exit"""
+        self.stopped = True
+        self.join()
 
 class FaceAttendanceSystem:
+    # Encoding policy: enrollment is rare, so it keeps dlib's full-quality settings
+    # (one jitter, 68-point landmarks). Per-frame recognition skips jittering and
+    # aligns with the 5-point model, roughly halving the embedder cost.
+    ENROLL_JITTERS = 1
+    ENROLL_MODEL = "large"
+    RECOGNIZE_JITTERS = 0
+    RECOGNIZE_MODEL = "small"
+    
+    # Same default as face_recognition.compare_faces. Encodings are matched on unit
+    # vectors, where |a - b|^2 = 2 - 2 cos, so the distance maps to a cosine of 0.82.
+    MATCH_TOLERANCE = 0.6
+    MATCH_SIMILARITY = 1 - MATCH_TOLERANCE ** 2 / 2
+    
+    # Seconds between batched writes of new attendance rows
+    FLUSH_INTERVAL = 5.0
+    
     def __init__(self):
         self.images_dir = "images"
         self.attendance_file = "attendance.csv"
-        self.known_faces = []
+        self.cache_file = "known_faces.bin"
+        self.cache_index_file = "known_faces.json"
+        self.detect_every = 3
+        self.gpu_batch_size = 8
+        self.use_gpu = dlib.DLIB_USE_CUDA
+        self.yunet_model = "face_detection_yunet.onnx"
+        self.known_faces = np.empty((0, 128), dtype=np.float32)
+        self.known_faces_q = np.empty((0, 128), dtype=np.int8)
+        self.scale = 1.0
+        self.index = None
+        self._cap = None
+        self._user_paths = {}
         self.known_names = []
+        self.known_files = []
+        self.known_sigs = []
+        self.no_face_sigs = {}
         
         # Create images directory if it doesn't exist
         if not os.path.exists(self.images_dir):
@@ -21,48 +144,289 @@ class FaceAttendanceSystem:
             with open(self.attendance_file, 'w', newline='') as f:
                 writer = csv.writer(f)
                 writer.writerow(['Name', 'Date', 'Time'])
+        
+        # Read the attendance log once so duplicate checks don't rescan the file
+        self._marked = set()
+        with open(self.attendance_file, 'r', newline='') as f:
+            for row in csv.reader(f):
+                if len(row) >= 2:
+                    self._marked.add((row[0], row[1]))
+        
+        # Keep the log open for appending instead of reopening it per record
+        self._att_fh = open(self.attendance_file, 'a', newline='')
+        self._att_wr = csv.writer(self._att_fh)
+        
+        # New rows are buffered and written in batches by a periodic flush
+        self._pending = []
+        self._att_lock = threading.Lock()
+        self._flush_timer = None
+        self._schedule_flush()
+        
+        # Use OpenCV's YuNet detector when its model file is available, otherwise dlib's HOG
+        self.detector = None
+        if os.path.exists(self.yunet_model):
+            self.detector = cv2.FaceDetectorYN_create(self.yunet_model, "", (320, 240), 0.7, 0.3, 5000)
                 
         # Load existing face encodings
         self.load_known_faces()
         
+        # Compile the fallback matcher now rather than on the first recognized frame
+        if faiss is None and njit is not None:
+            probe = np.zeros((1, 128), dtype=np.int8)
+            _nearest(probe, probe, np.empty(1, dtype=np.int64), np.empty(1, dtype=np.int64))
+        
     def load_known_faces(self):
-        """Load all known face encodings from the images directory"""
+        """Load all known face encodings, re-encoding only new or changed images"""
         print("Loading known faces...")
-        self.known_faces = []
-        self.known_names = []
+        table, cached, cached_no_face = self._load_cache()
+        entries = []
+        pending = []
         
-        # List all files in the images directory
+        # Scan the images directory, reusing cached encodings for unchanged files
+        self._user_paths = {}
+        no_face_sigs = {}
         if os.path.exists(self.images_dir):
-            for filename in os.listdir(self.images_dir):
-                if filename.endswith(('.jpg', '.jpeg', '.png')):
-                    # Get person name from filename (without extension)
-                    name = os.path.splitext(filename)[0]
-                    
-                    # Load image and get face encoding
-                    image_path = os.path.join(self.images_dir, filename)
-                    image = face_recognition.load_image_file(image_path)
+            for entry in os.scandir(self.images_dir):
+                user_name = _split_image_name(entry.name)
+                if user_name is not None:
+                    self._user_paths.setdefault(user_name.lower(), []).append(entry.path)
+                    stat = entry.stat()
+                    sig = (stat.st_mtime, stat.st_size)
                     
-                    # Get face encodings (might be more than one face in the image)
-                    face_encodings = face_recognition.face_encodings(image)
+                    # Images already known to have no face are skipped until they change
+                    if cached_no_face.get(entry.name) == sig:
+                        no_face_sigs[entry.name] = sig
+                        print(f"No face found in image: {entry.name}")
+                        continue
                     
-                    # If at least one face is found, use the first one
-                    if len(face_encodings) > 0:
-                        self.known_faces.append(face_encodings[0])
-                        self.known_names.append(name)
-                        print(f"Loaded face for: {name}")
-                    else:
-                        print(f"No face found in image: {filename}")
+                    entries.append((entry.name, entry.path, sig))
+                    if entry.name not in cached or cached[entry.name][0] != sig:
+                        pending.append(entry.path)
+        
+        # Encode new or changed images, in parallel when there is more than one.
+        # Workers are spawned rather than forked so a CUDA-enabled dlib initializes cleanly.
+        encoded = {}
+        if len(pending) > 1:
+            with ProcessPoolExecutor(mp_context=get_context('spawn')) as executor:
+                encoded = dict(executor.map(_encode_one, pending))
+        elif pending:
+            encoded = dict([_encode_one(pending[0])])
+        
+        names = []
+        files = []
+        sigs = []
+        encodings = []
+        cached_rows = []
+        for filename, path, sig in entries:
+            # Get person name from filename (without extension)
+            name = _split_image_name(filename)
+            
+            if path in encoded:
+                encoding = encoded[path]
+                if encoding is None:
+                    no_face_sigs[filename] = sig
+                    print(f"No face found in image: {filename}")
+                    continue
+                print(f"Loaded face for: {name}")
+            else:
+                row = cached[filename][1]
+                cached_rows.append(row)
+                encoding = table[row]
+            
+            names.append(name)
+            files.append(filename)
+            sigs.append(sig)
+            encodings.append(encoding)
+        
+        self.known_names = names
+        self.known_files = files
+        self.known_sigs = sigs
+        self.no_face_sigs = no_face_sigs
+        
+        if (len(cached_rows) == len(files) and cached_rows == list(range(len(table)))
+                and no_face_sigs == cached_no_face):
+            # Nothing changed: keep the mapped cache as the raw table and skip rewriting it
+            self.known_faces = table
+        else:
+            # Keep encodings as one contiguous (N, 128) array for vectorized matching.
+            # Drop the cache mapping first so the file can be rewritten.
+            self.known_faces = np.ascontiguousarray(
+                np.array(encodings, dtype=np.float32).reshape(-1, 128))
+            table = cached = cached_no_face = encodings = encoding = None
+            self._save_cache()
+        self._build_index()
         
         print(f"Loaded {len(self.known_faces)} faces.")
     
+    def _add_face(self, filename, encoding):
+        """Add one enrolled image's encoding, replacing any previous one for that file"""
+        self._remove_entry(filename)
+        self.no_face_sigs.pop(filename, None)
+        path = os.path.join(self.images_dir, filename)
+        name = _split_image_name(filename)
+        stat = os.stat(path)
+        paths = self._user_paths.setdefault(name.lower(), [])
+        if path not in paths:
+            paths.append(path)
+        self.known_names.append(name)
+        self.known_files.append(filename)
+        self.known_sigs.append((stat.st_mtime, stat.st_size))
+        self.known_faces = np.vstack([self.known_faces, encoding.astype(np.float32)[None, :]])
+        self._build_index()
+        self._save_cache()
+    
+    def _drop_face(self, filename):
+        """Remove a deleted image's encoding or cached no-face result"""
+        had_face = self._remove_entry(filename)
+        had_no_face = self.no_face_sigs.pop(filename, None) is not None
+        if had_face:
+            self._build_index()
+        if had_face or had_no_face:
+            self._save_cache()
+    
+    def _remove_entry(self, filename):
+        """Remove a file's row from the known-face tables; return whether it was present"""
+        if filename not in self.known_files:
+            return False
+        i = self.known_files.index(filename)
+        del self.known_names[i]
+        del self.known_files[i]
+        del self.known_sigs[i]
+        self.known_faces = np.delete(self.known_faces, i, axis=0)
+        return True
+    
+    def _build_index(self):
+        """Rebuild the int8-quantized inner-product index over the normalized known encodings"""
+        # Normalize once so matching is a single dot product per known face
+        known_unit = self._normalize(self.known_faces)
+        
+        # One shared scale maps the unit-vector components onto int8
+        if len(known_unit) > 0:
+            self.scale = float(np.abs(known_unit).max()) / 127 or 1.0
+        self.known_faces_q = self._quantize(known_unit)
+        
+        self.index = None
+        if faiss is not None and len(known_unit) > 0:
+            self.index = faiss.IndexScalarQuantizer(
+                128, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+            self.index.train(known_unit)
+            self.index.add(known_unit)
+    
+    def _normalize(self, encodings):
+        """Scale each encoding to unit length"""
+        encodings = np.asarray(encodings, dtype=np.float32)
+        norms = np.linalg.norm(encodings, axis=1, keepdims=True)
+        return np.ascontiguousarray(encodings / np.maximum(norms, 1e-12))
+    
+    def _quantize(self, encodings):
+        """Quantize float encodings to int8 using the known-faces scale"""
+        return np.clip(np.round(encodings / self.scale), -127, 127).astype(np.int8)
+    
+    def _match(self, probes):
+        """Return (best index, cosine similarity) of the most similar known face for each probe"""
+        probes = self._normalize(np.reshape(probes, (-1, 128)))
+        if self.index is not None:
+            similarities, indices = self.index.search(probes, 1)
+            return indices[:, 0], similarities[:, 0]
+        
+        # Inner products in int8 units, rescaled back to float
+        probes_q = self._quantize(probes)
+        indices = np.empty(len(probes_q), dtype=np.int64)
+        dots = np.empty(len(probes_q), dtype=np.int64)
+        _nearest(self.known_faces_q, probes_q, indices, dots)
+        return indices, dots * self.scale ** 2
+    
+    def _load_cache(self):
+        """Map the cached encodings; return (table, {filename: (sig, row)}, {no-face filename: sig})"""
+        empty = np.empty((0, 128), dtype=np.float32)
+        if not os.path.exists(self.cache_index_file) or not os.path.exists(self.cache_file):
+            return empty, {}, {}
+        try:
+            with open(self.cache_index_file, 'r') as f:
+                index = json.load(f)
+            count = len(index['files'])
+            
+            # The table starts with a random token that its index must repeat, so a crash
+            # between the two writes can't pair encodings with another save's names
+            with open(self.cache_file, 'rb') as f:
+                token = f.read(CACHE_TOKEN_SIZE)
+            if (token.hex() != index['token']
+                    or os.path.getsize(self.cache_file) != CACHE_TOKEN_SIZE + count * 128 * 4):
+                raise ValueError("encoding file does not match its index")
+            
+            # Map the table instead of reading it; _build_index still touches every row
+            # when it normalizes and quantizes, but no parsing or extra raw copy is made
+            table = empty
+            if count > 0:
+                table = np.memmap(self.cache_file, dtype=np.float32, mode='r',
+                                  offset=CACHE_TOKEN_SIZE, shape=(count, 128))
+            cached = {
+                filename: ((float(mtime), int(size)), row)
+                for row, (filename, (mtime, size)) in enumerate(zip(index['files'], index['sigs']))
+            }
+            no_face = {
+                filename: (float(mtime), int(size))
+                for filename, (mtime, size) in index.get('no_face', {}).items()
+            }
+            return table, cached, no_face
+        except Exception as e:
+            print(f"Ignoring unreadable face cache: {e}")
+            return empty, {}, {}
+    
+    def _save_cache(self):
+        """Write the current encodings as raw float32 plus a JSON index of names and file signatures"""
+        # Never write the cache from a mapping of itself; truncating the file would pull
+        # the pages out from under the reads
+        if isinstance(self.known_faces, np.memmap):
+            self.known_faces = np.array(self.known_faces)
+        
+        # Write both files under temporary names and swap them in, table first
+        token = os.urandom(CACHE_TOKEN_SIZE)
+        temp_file = self.cache_file + '.tmp'
+        with open(temp_file, 'wb') as f:
+            f.write(token)
+            np.ascontiguousarray(self.known_faces, dtype=np.float32).tofile(f)
+        os.replace(temp_file, self.cache_file)
+        
+        temp_index_file = self.cache_index_file + '.tmp'
+        with open(temp_index_file, 'w') as f:
+            json.dump({
+                'token': token.hex(),
+                'names': self.known_names,
+                'files': self.known_files,
+                'sigs': [list(sig) for sig in self.known_sigs],
+                'no_face': {filename: list(sig) for filename, sig in self.no_face_sigs.items()},
+            }, f)
+        os.replace(temp_index_file, self.cache_index_file)
+    
+    def _cam(self):
+        """Open the webcam on first use and keep it open across menu actions"""
+        if self._cap is None or not self._cap.isOpened():
+            self._cap = cv2.VideoCapture(0, cv2.CAP_DSHOW if os.name == 'nt' else cv2.CAP_ANY)
+            
+            # Ask for compressed 640x480 at a steady 30 FPS instead of the driver's raw default
+            self._cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+            self._cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
+            self._cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+            self._cap.set(cv2.CAP_PROP_FPS, 30)
+            
+            # Don't let the driver queue up stale frames; we always want the newest
+            self._cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return self._cap
+    
     def capture_new_image(self, name):
         """Capture a new face image for enrollment"""
         if not name:
             print("Name cannot be empty")
             return False
+        
+        # The name becomes the image filename, so it can't contain path separators
+        if '/' in name or '\\' in name:
+            print("Name cannot contain '/' or '\\'")
+            return False
             
-        # Initialize the webcam
-        cap = cv2.VideoCapture(0)
+        # Get the shared webcam
+        cap = self._cam()
         
         if not cap.isOpened():
             print("Error: Could not open webcam")
@@ -83,13 +447,13 @@ class FaceAttendanceSystem:
             key = cv2.waitKey(1) & 0xFF
             if key == 27:  # ESC key
                 print("Canceled image capture")
-                cap.release()
                 cv2.destroyAllWindows()
                 return False
                 
             elif key == 32:  # SPACE key
                 # Check if face is detected in the frame
-                face_locations = face_recognition.face_locations(frame)
+                rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                face_locations = face_recognition.face_locations(rgb_frame)
                 
                 if len(face_locations) == 0:
                     print("No face detected! Please try again.")
@@ -99,18 +463,22 @@ class FaceAttendanceSystem:
                     continue
                     
                 # Save the image with the person's name
-                filename = os.path.join(self.images_dir, f"/images/person.jpg")
-                cv2.imwrite(filename, frame)
+                filename = os.path.join(self.images_dir, f"{name}.jpg")
+                if not cv2.imwrite(filename, frame):
+                    print(f"Error: Could not save image as {filename}")
+                    cv2.destroyAllWindows()
+                    return False
                 print(f"Image saved as {filename}")
                 
-                # Update known faces
-                self.load_known_faces()
+                # Encode just the new face instead of reloading every image
+                encoding = face_recognition.face_encodings(
+                    rgb_frame, known_face_locations=face_locations,
+                    num_jitters=self.ENROLL_JITTERS, model=self.ENROLL_MODEL)[0]
+                self._add_face(os.path.basename(filename), encoding)
                 
-                cap.release()
                 cv2.destroyAllWindows()
                 return True
         
-        cap.release()
         cv2.destroyAllWindows()
         return False
     
@@ -121,8 +489,8 @@ class FaceAttendanceSystem:
             print("No known faces found. Please enroll a user first.")
             return
             
-        # Initialize the webcam
-        cap = cv2.VideoCapture(0)
+        # Get the shared webcam
+        cap = self._cam()
         
         if not cap.isOpened():
             print("Error: Could not open webcam")
@@ -131,52 +499,125 @@ class FaceAttendanceSystem:
         # Track who has already been marked to avoid duplicates
         marked_attendance = set()
         
+        # Boxes and names from the last detection pass, redrawn on skipped frames
+        frame_count = 0
+        last_results = []
+        
+        # Frames waiting for the next batched GPU detection
+        pending_frames = deque()
+        
         print("Starting face recognition... Press 'q' to quit.")
         
+        # Capture on a background thread so camera I/O overlaps with detection
+        grabber = _Grabber(cap)
+        grabber.start()
+        
         while True:
-            ret, frame = cap.read()
+            frame = grabber.q.get()
             
-            if not ret:
+            if frame is None:
                 print("Failed to grab frame")
                 break
                 
-            # Find all faces in the current frame
-            face_locations = face_recognition.face_locations(frame)
-            face_encodings = face_recognition.face_encodings(frame, face_locations)
+            if self.use_gpu:
+                # Queue frames and run the CNN detector over a whole batch in one GPU call
+                small_frame = cv2.cvtColor(cv2.resize(frame, (0, 0), fx=0.25, fy=0.25), cv2.COLOR_BGR2RGB)
+                pending_frames.append((frame, small_frame))
+                if len(pending_frames) < self.gpu_batch_size:
+                    continue
+                
+                batch_locations = face_recognition.batch_face_locations(
+                    [small for _, small in pending_frames],
+                    number_of_times_to_upsample=0,
+                    batch_size=len(pending_frames))
+                ready = [(queued_frame, self._identify(small, face_locations, marked_attendance))
+                         for (queued_frame, small), face_locations in zip(pending_frames, batch_locations)]
+                pending_frames.clear()
+            else:
+                # Re-run detection only every few frames; subjects barely move in between
+                if frame_count % self.detect_every == 0:
+                    # Detect on a quarter-size copy; face_recognition expects RGB, OpenCV gives BGR
+                    small_bgr = cv2.resize(frame, (0, 0), fx=0.25, fy=0.25)
+                    small_frame = cv2.cvtColor(small_bgr, cv2.COLOR_BGR2RGB)
+                    
+                    # Find all faces in the current frame
+                    face_locations = self._detect_faces(small_bgr, small_frame)
+                    last_results = self._identify(small_frame, face_locations, marked_attendance)
+                frame_count += 1
+                ready = [(frame, last_results)]
             
-            # Process each face found in the frame
-            for (top, right, bottom, left), face_encoding in zip(face_locations, face_encodings):
-                # Try to match with known faces
-                matches = face_recognition.compare_faces(self.known_faces, face_encoding, tolerance=0.6)
-                name = "Unknown"
+            quit_requested = False
+            for frame, results in ready:
+                # Draw a box around each face and display the name
+                for (top, right, bottom, left), name in results:
+                    cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
+                    cv2.putText(frame, name, (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (0, 255, 0), 2)
                 
-                # Find the best match
-                face_distances = face_recognition.face_distance(self.known_faces, face_encoding)
-                if len(face_distances) > 0:
-                    best_match_index = face_distances.argmin()
-                    if matches[best_match_index]:
-                        name = self.known_names[best_match_index]
-                        
-                        # Mark attendance if not already marked
-                        if name not in marked_attendance:
-                            self.mark_attendance(name)
-                            marked_attendance.add(name)
-                            print(f"Attendance marked for {name}")
+                # Display the resulting image
+                cv2.imshow('Face Recognition', frame)
                 
-                # Draw a box around the face and display the name
-                cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
-                cv2.putText(frame, name, (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (0, 255, 0), 2)
-            
-            # Display the resulting image
-            cv2.imshow('Face Recognition', frame)
+                # Exit on 'q' key press
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    quit_requested = True
+                    break
             
-            # Exit on 'q' key press
-            if cv2.waitKey(1) & 0xFF == ord('q'):
+            if quit_requested:
                 break
         
-        cap.release()
+        grabber.stop()
         cv2.destroyAllWindows()
     
+    def _detect_faces(self, small_bgr, small_frame):
+        """Return (top, right, bottom, left) face boxes for a quarter-size frame"""
+        if self.detector is None:
+            return face_recognition.face_locations(small_frame, model="hog")
+        
+        height, width = small_bgr.shape[:2]
+        self.detector.setInputSize((width, height))
+        _, faces = self.detector.detect(small_bgr)
+        if faces is None:
+            return []
+        
+        # YuNet reports (x, y, w, h); clamp to the frame and convert for face_recognition
+        face_locations = []
+        for x, y, w, h in faces[:, :4]:
+            top, left = max(0, int(y)), max(0, int(x))
+            bottom, right = min(height, int(y + h)), min(width, int(x + w))
+            face_locations.append((top, right, bottom, left))
+        return face_locations
+    
+    def _identify(self, small_frame, face_locations, marked_attendance):
+        """Name the faces found in a quarter-size frame and mark their attendance"""
+        results = []
+        if len(face_locations) == 0:
+            return results
+        
+        face_encodings = face_recognition.face_encodings(
+            small_frame, face_locations,
+            num_jitters=self.RECOGNIZE_JITTERS, model=self.RECOGNIZE_MODEL)
+        
+        # Look up all faces in the frame with one batched search
+        match_indices, match_similarities = self._match(face_encodings)
+        matched = match_similarities > self.MATCH_SIMILARITY
+        
+        # Process each face found in the frame
+        for i, (top, right, bottom, left) in enumerate(face_locations):
+            name = "Unknown"
+            
+            if matched[i]:
+                name = self.known_names[match_indices[i]]
+                
+                # Mark attendance if not already marked
+                if name not in marked_attendance:
+                    self.mark_attendance(name)
+                    marked_attendance.add(name)
+                    print(f"Attendance marked for {name}")
+            
+            # Scale the box back up to the full-size frame
+            results.append(((top * 4, right * 4, bottom * 4, left * 4), name))
+        
+        return results
+    
     def mark_attendance(self, name):
         """Mark attendance for a recognized person"""
         now = datetime.datetime.now()
@@ -184,55 +625,77 @@ class FaceAttendanceSystem:
         time_string = now.strftime("%H:%M:%S")
         
         # Check if user already has attendance for today
-        if os.path.exists(self.attendance_file):
-            with open(self.attendance_file, 'r') as f:
-                reader = csv.reader(f)
-                for row in reader:
-                    if len(row) >= 2 and row[0] == name and row[1] == date_string:
-                        print(f"{name} already has attendance marked for today.")
-                        return
+        key = (name, date_string)
+        if key in self._marked:
+            print(f"{name} already has attendance marked for today.")
+            return
         
         # Append attendance record to CSV
-        with open(self.attendance_file, 'a', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow([name, date_string, time_string])
+        with self._att_lock:
+            self._pending.append((name, date_string, time_string))
+            self._marked.add(key)
+    
+    def _schedule_flush(self):
+        """Start the timer for the next batched attendance write"""
+        self._flush_timer = threading.Timer(self.FLUSH_INTERVAL, self._periodic_flush)
+        self._flush_timer.daemon = True
+        self._flush_timer.start()
+    
+    def _periodic_flush(self):
+        """Write buffered rows and reschedule"""
+        self._flush()
+        self._schedule_flush()
+    
+    def _flush(self):
+        """Write any buffered attendance rows to the CSV"""
+        with self._att_lock:
+            if self._pending:
+                self._att_wr.writerows(self._pending)
+                self._att_fh.flush()
+                self._pending.clear()
+    
+    def close(self):
+        """Release the webcam and files held open by the system"""
+        if self._cap is not None:
+            self._cap.release()
+        cv2.destroyAllWindows()
+        self._flush_timer.cancel()
+        self._flush()
+        self._att_fh.close()
     
     def list_users(self):
         """List all enrolled users"""
-        if os.path.exists(self.images_dir):
-            users = [os.path.splitext(f)[0] for f in os.listdir(self.images_dir) 
-                   if f.endswith(('.jpg', '.jpeg', '.png'))]
-            
-            if users:
-                print("\nEnrolled users:")
-                for idx, user in enumerate(users, 1):
-                    print(f"{idx}. {user}")
-            else:
-                print("\nNo users enrolled yet.")
+        users = [_split_image_name(os.path.basename(path))
+                 for paths in self._user_paths.values() for path in paths]
+        
+        if users:
+            print("\nEnrolled users:")
+            for idx, user in enumerate(users, 1):
+                print(f"{idx}. {user}")
         else:
             print("\nNo users enrolled yet.")
     
     def delete_user(self, name):
         """Delete a user from the system"""
-        # Check all image files in the directory
-        if os.path.exists(self.images_dir):
-            for filename in os.listdir(self.images_dir):
-                if filename.endswith(('.jpg', '.jpeg', '.png')):
-                    user_name = os.path.splitext(filename)[0]
-                    if user_name.lower() == name.lower():
-                        # Remove the file
-                        os.remove(os.path.join(self.images_dir, filename))
-                        print(f"User {name} has been deleted.")
-                        
-                        # Reload known faces
-                        self.load_known_faces()
-                        return True
+        # Names match case-insensitively, so remove every image stored under this name
+        paths = self._user_paths.pop(name.lower(), [])
+        if paths:
+            for path in paths:
+                # Remove the file
+                if os.path.exists(path):
+                    os.remove(path)
+                
+                # Drop the user's encoding without reloading every image
+                self._drop_face(os.path.basename(path))
+            print(f"User {name} has been deleted.")
+            return True
         
         print(f"User {name} not found.")
         return False
     
     def view_attendance(self):
         """View the attendance records"""
+        self._flush()
         if not os.path.exists(self.attendance_file):
             print("No attendance records found.")
             return
@@ -255,41 +718,45 @@ class FaceAttendanceSystem:
 def main():
     system = FaceAttendanceSystem()
     
-    while True:
-        print("\n===== Face Recognition Attendance System =====")
-        print("1. Enroll new user")
-        print("2. Take attendance")
-        print("3. List enrolled users")
-        print("4. Delete a user")
-        print("5. View attendance records")
-        print("0. Exit")
-        
-        choice = input("\nEnter your choice: ")
-        
-        if choice == '1':
-            name = input("Enter the name for the new user: ")
-            system.capture_new_image(name)
-        
-        elif choice == '2':
-            system.recognize_faces()
-        
-        elif choice == '3':
-            system.list_users()
-        
-        elif choice == '4':
-            system.list_users()
-            name = input("Enter the name of the user to delete: ")
-            system.delete_user(name)
-        
-        elif choice == '5':
-            system.view_attendance()
-        
-        elif choice == '0':
-            print("Exiting...")
-            break
-        
-        else:
-            print("Invalid choice. Please try again.")
+    # Always write buffered attendance and release the camera, even on Ctrl+C or an error
+    try:
+        while True:
+            print("\n===== Face Recognition Attendance System =====")
+            print("1. Enroll new user")
+            print("2. Take attendance")
+            print("3. List enrolled users")
+            print("4. Delete a user")
+            print("5. View attendance records")
+            print("0. Exit")
+            
+            choice = input("\nEnter your choice: ")
+            
+            if choice == '1':
+                name = input("Enter the name for the new user: ")
+                system.capture_new_image(name)
+            
+            elif choice == '2':
+                system.recognize_faces()
+            
+            elif choice == '3':
+                system.list_users()
+            
+            elif choice == '4':
+                system.list_users()
+                name = input("Enter the name of the user to delete: ")
+                system.delete_user(name)
+            
+            elif choice == '5':
+                system.view_attendance()
+            
+            elif choice == '0':
+                print("Exiting...")
+                break
+            
+            else:
+                print("Invalid choice. Please try again.")
+    finally:
+        system.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file